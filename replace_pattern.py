@@ -1,132 +1,396 @@
 import os
 import re
+import mmap
+import stat
 import fnmatch
 import argparse
+import functools
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
 # === COLOR UTILITIES ===
 class Color:
     GREEN = '\033[92m'
     GRAY = '\033[90m'
+    RED = '\033[91m'
     RESET = '\033[0m'
 
 def print_color(text, color):
     print(f"{color}{text}{Color.RESET}")
 
 # === ARGUMENT PARSING ===
-parser = argparse.ArgumentParser(
-    description='Generic recursive regex replacer for ASCII text files.'
-)
-
-# --- Target selection (exactly one required) ---
-target_group = parser.add_mutually_exclusive_group(required=True)
-target_group.add_argument(
-    '--root',
-    help='Root directory to recursively scan'
-)
-target_group.add_argument(
-    '--paths',
-    nargs='+',
-    help='Explicit list of files to process'
-)
-target_group.add_argument(
-    '--paths-file',
-    help='Text file containing one file path per line'
-)
-
-# --- Replacement options ---
-parser.add_argument('--pattern', required=True,
-                    help='Regex pattern to search (with optional capture groups)')
-parser.add_argument('--replace', required=True,
-                    help='Replacement string (supports \\1, \\2, etc.)')
-
-# --- Behavior options ---
-parser.add_argument('--dry-run', action='store_true',
-                    help='Simulate only, do not modify files')
-parser.add_argument('--log', default='replacement_log.txt',
-                    help='Log file path')
-parser.add_argument('--files', nargs='*',
-                    help='Include only files matching these patterns (e.g. *.xml)')
-parser.add_argument('--files-exclude', nargs='*',
-                    help='Exclude files matching these patterns (e.g. *.bak)')
-parser.add_argument('--summary-only', action='store_true',
-                    help='Suppress file-level replacement output')
-
-args = parser.parse_args()
-
-# === CONFIG ===
-root_dir = args.root
-regex_pattern = args.pattern
-replacement_template = args.replace
-dry_run = args.dry_run
-log_file_path = args.log
-include_patterns = args.files or ['*']
-exclude_patterns = args.files_exclude or []
-summary_only = args.summary_only
-
-# === COMPILE PATTERN ===
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Generic recursive regex replacer for ASCII text files.'
+    )
+
+    # --- Target selection (exactly one required) ---
+    target_group = parser.add_mutually_exclusive_group(required=True)
+    target_group.add_argument(
+        '--root',
+        help='Root directory to recursively scan'
+    )
+    target_group.add_argument(
+        '--paths',
+        nargs='+',
+        help='Explicit list of files to process'
+    )
+    target_group.add_argument(
+        '--paths-file',
+        help='Text file containing one file path per line'
+    )
+
+    # --- Replacement options ---
+    parser.add_argument('--pattern', required=True,
+                        help='Regex pattern to search (with optional capture groups)')
+    parser.add_argument('--replace', required=True,
+                        help='Replacement string (supports \\1, \\2, etc.)')
+
+    # --- Behavior options ---
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Simulate only, do not modify files')
+    parser.add_argument('--log', default='replacement_log.txt',
+                        help='Log file path')
+    parser.add_argument('--no-log', action='store_true',
+                        help='Do not write a log file')
+    parser.add_argument('--files', nargs='*',
+                        help='Include only files matching these patterns (e.g. *.xml)')
+    parser.add_argument('--files-exclude', nargs='*',
+                        help='Exclude files matching these patterns (e.g. *.bak)')
+    parser.add_argument('--summary-only', action='store_true',
+                        help='Suppress file-level replacement output')
+    parser.add_argument('--jobs', type=positive_int, default=os.cpu_count() or 1,
+                        help='Number of worker processes (default: CPU count)')
+    return parser.parse_args()
+
+# === LITERAL PREFILTER ===
+REGEX_METACHARS = set('.^$*+?{}[]()|\\')
+QUANTIFIER_CHARS = set('*+?{')
+# Escapes that spell out a character or a backreference by number.
+CODE_ESCAPE_CHARS = set('0123456789xuUN')
+QUANTIFIER_RE = re.compile(r'\{\d*(?:,\d*)?\}')
+
+def extract_literal(regex, flags):
+    """Return the longest literal run every match must contain, or ''."""
+    if flags & (re.IGNORECASE | re.VERBOSE):
+        return ''
+    best = run = ''
+    depth = 0
+    i = 0
+    while i < len(regex):
+        c = regex[i]
+        literal = None
+        if c == '\\':
+            i += 1
+            if regex[i:i + 1] in CODE_ESCAPE_CHARS:
+                return ''
+            if i < len(regex) and not regex[i].isalnum():
+                literal = regex[i]
+        elif c == '[':
+            i += 1
+            if regex.startswith('^', i):
+                i += 1
+            if regex.startswith(']', i):
+                i += 1
+            while i < len(regex) and regex[i] != ']':
+                i += 2 if regex[i] == '\\' else 1
+        elif c == '{':
+            quantifier = QUANTIFIER_RE.match(regex, i)
+            if not quantifier:
+                return ''
+            i = quantifier.end() - 1
+        elif c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == '|' and depth == 0:
+            return ''
+        elif c not in REGEX_METACHARS:
+            literal = c
+        i += 1
+        # A literal followed by a quantifier is optional, so it ends the run.
+        if depth == 0 and literal is not None and regex[i:i + 1] not in QUANTIFIER_CHARS:
+            run += literal
+        else:
+            best = max(best, run, key=len)
+            run = ''
+    return max(best, run, key=len)
+
+# === REPLACEMENT TEMPLATE ===
 try:
-    pattern = re.compile(regex_pattern)
-except re.error as e:
-    print(f"Invalid regex pattern: {e}")
-    exit(1)
+    from re import _parser as template_parser  # Python 3.11+
+except ImportError:
+    import sre_parse as template_parser  # Python 3.10 and older
 
-# === COUNTERS & LOG ===
-file_change_count = 0
-total_replacements = 0
-log_lines = []
+def compile_expander(pattern, template):
+    """Return a match -> replacement function that parses the template only once."""
+    if '\\' not in template:
+        return lambda m: template
+    # Parsing up front also reports template errors at startup.
+    parsed = template_parser.parse_template(template, pattern)
+    if hasattr(template_parser, 'expand_template'):
+        # Up to Python 3.11, Match.expand re-parses the template on every call.
+        return functools.partial(template_parser.expand_template, parsed)
+    # Python 3.12+ has no expand_template but caches the compiled template
+    # inside Match.expand.
+    return lambda m: m.expand(template)
 
-def log_entry(file_path, old_value, new_value):
-    timestamp = datetime.now().isoformat()
-    entry = f"[{timestamp}] File: {file_path}\n    Replaced: {old_value} -> {new_value}\n"
-    log_lines.append(entry)
+# === WORKER STATE ===
+def init_worker(regex, template, simulate, collect):
+    """Compile the pattern once per worker process."""
+    global pattern, replacement_template, expand_replacement, dry_run, collect_changes
+    global required_literal, required_literal_bytes
+    pattern = re.compile(regex)
+    replacement_template = template
+    expand_replacement = compile_expander(pattern, template)
+    dry_run = simulate
+    collect_changes = collect
+    required_literal = extract_literal(regex, pattern.flags)
+    # ASCII bytes are identical in UTF-8 and latin-1, so they can be searched undecoded.
+    # Line breaks are excluded because the raw bytes may still hold CRLF.
+    searchable = required_literal.isascii() and not any(c in required_literal for c in '\r\n')
+    required_literal_bytes = required_literal.encode('ascii') if searchable else b''
 
-# === FILE FILTER ===
-def file_is_included(filename):
-    included = any(fnmatch.fnmatch(filename, pat) for pat in include_patterns)
-    excluded = any(fnmatch.fnmatch(filename, pat) for pat in exclude_patterns)
-    return included and not excluded
+# === READ FILE ===
+# Files up to this size are read into one reused buffer; larger ones are mapped.
+IO_BUFFER_SIZE = 128 * 1024
+# Files with a NUL byte in their first 4 KiB are treated as binary and skipped.
+BINARY_SNIFF_SIZE = 4096
+io_buffer = bytearray(IO_BUFFER_SIZE)
+
+def decode_text(data):
+    """Return (text, encoding, newline), trying UTF-8 before falling back to latin-1.
+
+    Like text-mode open(), CRLF and lone CR line breaks become LF; newline
+    records the style the file used so it can be written back unchanged.
+    """
+    try:
+        text, encoding = str(data, 'utf-8'), 'utf-8'
+    except UnicodeDecodeError:
+        text, encoding = str(data, 'latin-1'), 'latin-1'
+    if '\r' not in text:
+        return text, encoding, '\n'
+    newline = '\r\n' if '\r\n' in text else '\r'
+    return text.replace('\r\n', '\n').replace('\r', '\n'), encoding, newline
+
+def cannot_match(data, size):
+    """Return True if data[:size] looks binary or lacks the required literal."""
+    if data.find(b'\0', 0, min(size, BINARY_SNIFF_SIZE)) != -1:
+        return True
+    return bool(required_literal_bytes) and data.find(required_literal_bytes, 0, size) == -1
+
+def read_content(file_path):
+    """Return (content, encoding, newline), or Nones if the file cannot contain a match."""
+    data = None
+    with open(file_path, 'rb') as f:
+        st = os.fstat(f.fileno())
+        if stat.S_ISREG(st.st_mode) and st.st_size <= IO_BUFFER_SIZE:
+            size = f.readinto(io_buffer)
+            tail = f.read(1) if size == IO_BUFFER_SIZE else b''
+            if tail:
+                # Larger than fstat reported (pseudo-file or still growing): read it all.
+                data = bytes(io_buffer) + tail + f.read()
+            else:
+                if cannot_match(io_buffer, size):
+                    return None, None, None
+                with memoryview(io_buffer)[:size] as view:
+                    content, encoding, newline = decode_text(view)
+        elif stat.S_ISREG(st.st_mode):
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if cannot_match(mm, len(mm)):
+                    return None, None, None
+                content, encoding, newline = decode_text(mm)
+        else:
+            data = f.read()
+    if data is not None:
+        if cannot_match(data, len(data)):
+            return None, None, None
+        content, encoding, newline = decode_text(data)
+    if required_literal and not required_literal_bytes and required_literal not in content:
+        return None, None, None
+    return content, encoding, newline
+
+# === WRITE FILE ===
+def write_in_place(file_path, data):
+    with open(file_path, 'wb') as f:
+        f.write(data)
+
+def write_file(file_path, data):
+    """Replace file_path with data via a preallocated temp file and os.replace.
+
+    Hard-linked files, and files in directories we cannot create files in, are
+    rewritten in place instead: that keeps every link and needs no directory
+    write permission, but is not atomic.
+    """
+    # Resolve symlinks so the link itself is not replaced by a regular file.
+    target = os.path.realpath(file_path)
+    st = os.stat(target)
+    if st.st_nlink > 1:
+        write_in_place(target, data)
+        return
+    try:
+        fd, tmp_path = tempfile.mkstemp(prefix='.replace-', suffix='.tmp',
+                                        dir=os.path.dirname(target))
+    except PermissionError:
+        write_in_place(target, data)
+        return
+    try:
+        with open(fd, 'wb') as f:
+            if data and hasattr(os, 'posix_fallocate'):
+                try:
+                    os.posix_fallocate(fd, 0, len(data))
+                except OSError:
+                    pass  # not supported by every filesystem
+            f.write(data)
+        if hasattr(os, 'chown'):
+            # Keep owner and group where permitted; usually only root can keep the owner.
+            try:
+                os.chown(tmp_path, st.st_uid, st.st_gid)
+            except PermissionError:
+                try:
+                    os.chown(tmp_path, -1, st.st_gid)
+                except PermissionError:
+                    pass
+        # After chown, which may clear setuid/setgid bits.
+        os.chmod(tmp_path, stat.S_IMODE(st.st_mode))
+        os.replace(tmp_path, target)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
 
 # === PROCESS FILE ===
 def replace_in_file(file_path):
-    global file_change_count, total_replacements
+    """Return (count, preview_changes, timestamp, error) for one file.
 
+    Errors are returned rather than raised so one unreadable or unwritable
+    file does not abort the rest of the run.
+    """
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-    except UnicodeDecodeError:
-        with open(file_path, 'r', encoding='latin-1') as f:
-            content = f.read()
+        return rewrite_file(file_path) + (None,)
+    except OSError as e:
+        return 0, [], None, e.strerror or str(e)
+    except UnicodeEncodeError as e:
+        return 0, [], None, f"replacement cannot be encoded as {e.encoding}"
+
+def rewrite_file(file_path):
+    """Rewrite file_path (unless dry-running) and return (count, preview_changes, timestamp)."""
+    content, encoding, newline = read_content(file_path)
+    if content is None or pattern.search(content) is None:
+        return 0, [], None
+
+    # One timestamp per file, taken when the worker processes it.
+    timestamp = datetime.now().isoformat()
+    preview_changes = []
+    if collect_changes:
+        # Runs once per match: keep lookups local and avoid method calls.
+        expand, record = expand_replacement, preview_changes.append
 
-    matches = list(pattern.finditer(content))
-    if not matches:
+        def expand_match(m):
+            new_value = expand(m)
+            record((m[0], new_value))
+            return new_value
+
+        new_content, replacement_count = pattern.subn(expand_match, content)
+    else:
+        # re caches the parsed template and copies literal templates in C.
+        new_content, replacement_count = pattern.subn(replacement_template, content)
+    if replacement_count and not dry_run:
+        if newline != '\n':
+            new_content = new_content.replace('\n', newline)
+        write_file(file_path, new_content.encode(encoding))
+    return replacement_count, preview_changes, timestamp
+
+# === COUNTERS & LOG ===
+file_change_count = 0
+total_replacements = 0
+failed_file_count = 0
+log_events = []
+# Reporting options; the __main__ block sets them from the command line.
+summary_only = False
+write_log = True
+
+def log_entry(timestamp, file_path, preview_changes):
+    log_events.append((timestamp, file_path, preview_changes))
+
+def format_log():
+    return ''.join(
+        f"[{timestamp}] File: {file_path}\n    Replaced: {old} -> {new}\n"
+        for timestamp, file_path, preview_changes in log_events
+        for old, new in preview_changes
+    )
+
+def report_result(file_path, replacement_count, preview_changes, timestamp, error):
+    global file_change_count, total_replacements, failed_file_count
+
+    if error:
+        failed_file_count += 1
+        print_color(f"[Failed] {file_path}: {error}", Color.RED)
+        return
+
+    if not replacement_count:
         if not summary_only:
             print_color(f"[Skipped] {file_path}", Color.GRAY)
         return
 
     file_change_count += 1
-    total_replacements += len(matches)
-
-    preview_changes = [(m.group(0), pattern.sub(replacement_template, m.group(0))) for m in matches]
-    new_content = pattern.sub(replacement_template, content)
+    total_replacements += replacement_count
 
     if dry_run:
         if not summary_only:
             print_color(f"[Dry Run] Would modify: {file_path}", Color.GREEN)
             for old, new in preview_changes:
                 print(f"  Replace: {old} → {new}")
-        for old, new in preview_changes:
-            log_entry(file_path, old, new)
-    else:
-        with open(file_path, 'w', encoding='latin-1') as f:
-            f.write(new_content)
-        if not summary_only:
-            print_color(f"[Modified] {file_path}", Color.GREEN)
-        for old, new in preview_changes:
-            log_entry(file_path, old, new)
+    elif not summary_only:
+        print_color(f"[Modified] {file_path}", Color.GREEN)
+    if write_log:
+        log_entry(timestamp, file_path, preview_changes)
+
+# === FILE FILTER ===
+def compile_globs(patterns):
+    """Combine glob patterns into one compiled regex, or None if there are none."""
+    if not patterns:
+        return None
+    return re.compile('|'.join(fnmatch.translate(os.path.normcase(pat)) for pat in patterns))
+
+# Same as passing neither --files nor --files-exclude.
+include_re = compile_globs(['*'])
+exclude_re = None
+
+def file_is_included(filename):
+    filename = os.path.normcase(filename)
+    return bool(include_re.match(filename)) and not (exclude_re and exclude_re.match(filename))
 
 # === WALK FILES ===
-def iter_target_files():
+def walk_files(root):
+    """Yield included files under root in os.walk order, without following dir symlinks."""
+    stack = [root]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue
+        subdirs = []
+        with entries:
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    if not entry.is_symlink():
+                        subdirs.append(entry.path)
+                elif file_is_included(entry.name):
+                    yield entry.path
+        stack.extend(reversed(subdirs))
+
+def iter_target_files(args):
     if args.paths:
         for p in args.paths:
             yield p
@@ -141,24 +405,58 @@ def iter_target_files():
         return
 
     # args.root must be set here
-    for dirpath, _, filenames in os.walk(args.root):
-        for filename in filenames:
-            if file_is_included(filename):
-                yield os.path.join(dirpath, filename)
-                
-for file_path in iter_target_files():
-    replace_in_file(file_path)
-    
-# === SUMMARY ===
-summary = (
-    "\n=== SUMMARY ===\n"
-    f"Files modified:    {file_change_count}\n"
-    f"Replacements made: {total_replacements}\n"
-    f"Log saved to:      {log_file_path}\n"
-)
-print(summary)
-log_lines.append(summary)
-
-# === WRITE LOG FILE ===
-with open(log_file_path, 'w', encoding='utf-8') as log_file:
-    log_file.writelines(log_lines)
+    yield from walk_files(args.root)
+
+# === MAIN ===
+if __name__ == '__main__':
+    args = parse_args()
+
+    # === CONFIG ===
+    regex_pattern = args.pattern
+    log_file_path = args.log
+    write_log = not args.no_log
+    include_re = compile_globs(args.files or ['*'])
+    exclude_re = compile_globs(args.files_exclude)
+    summary_only = args.summary_only
+
+    # === COMPILE PATTERN ===
+    # Per-replacement pairs are only needed for the log and dry-run previews.
+    collect_changes = write_log or (args.dry_run and not summary_only)
+    init_args = (regex_pattern, args.replace, args.dry_run, collect_changes)
+    try:
+        init_worker(*init_args)
+    except (re.error, IndexError) as e:
+        # parse_template raises IndexError for unknown group names like \g<name>.
+        print(f"Invalid regex pattern or replacement: {e}")
+        exit(1)
+
+    target_files = list(iter_target_files(args))
+    if args.jobs > 1 and len(target_files) > 1:
+        with ProcessPoolExecutor(max_workers=args.jobs, initializer=init_worker,
+                                 initargs=init_args) as executor:
+            results = executor.map(replace_in_file, target_files, chunksize=64)
+            for file_path, result in zip(target_files, results):
+                report_result(file_path, *result)
+    else:
+        for file_path in target_files:
+            report_result(file_path, *replace_in_file(file_path))
+
+    # === SUMMARY ===
+    summary = (
+        "\n=== SUMMARY ===\n"
+        f"Files modified:    {file_change_count}\n"
+        f"Replacements made: {total_replacements}\n"
+    )
+    if failed_file_count:
+        summary += f"Files failed:      {failed_file_count}\n"
+    if write_log:
+        summary += f"Log saved to:      {log_file_path}\n"
+    print(summary)
+
+    # === WRITE LOG FILE ===
+    if write_log:
+        with open(log_file_path, 'wb') as log_file:
+            log_file.write((format_log() + summary).encode('utf-8'))
+
+    if failed_file_count:
+        exit(1)